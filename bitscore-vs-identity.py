@@ -1,20 +1,82 @@
 #!/usr/bin/env python
 
+import os
 import sys
 import platform
+import shlex
+import shutil
 import argparse
 import subprocess
-from random import choice, shuffle
-from matplotlib.pyplot import Axes
-import matplotlib.pyplot as plt
 from collections import Counter
-from tempfile import TemporaryDirectory
+from functools import cache, partial
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+from tempfile import TemporaryDirectory, gettempdir
 from pathlib import Path
 from time import asctime, time
 
-from dark.reads import AARead, DNARead
+import matplotlib
+import numpy as np
+
 from dark.aaVars import CODONS
-from dark.dimension import dimensionalIterator
+
+# The plot is only ever written to a file, so use the non-interactive Agg
+# backend (which must be selected before pyplot is imported).
+matplotlib.use("Agg")
+
+import matplotlib.pyplot as plt  # noqa: E402
+from matplotlib.pyplot import Axes  # noqa: E402
+
+# The AAs and their codons, computed once rather than per sample.
+AA_LIST = tuple(CODONS)
+CODON_LISTS = {aa: tuple(CODONS[aa]) for aa in AA_LIST}
+
+# The AAs (as strings and as ASCII bytes), and a table of the ASCII bytes of
+# the codons for each (padded with zeros to a common number of codons), so
+# random sequences can be made with NumPy indexing.
+AA_ARR = np.array(AA_LIST)
+AA_BYTES = np.frombuffer("".join(AA_LIST).encode("ascii"), dtype=np.uint8)
+SYNONYM_COUNTS = np.array([len(CODON_LISTS[aa]) for aa in AA_LIST])
+CODON_TABLE = np.array(
+    [
+        [list(codon.encode("ascii")) for codon in CODON_LISTS[aa]]
+        + [[0, 0, 0]] * (SYNONYM_COUNTS.max() - len(CODON_LISTS[aa]))
+        for aa in AA_LIST
+    ],
+    dtype=np.uint8,
+)
+
+# Misses (zero bitscores) are plotted as negative values, spaced by this amount.
+ZERO_BITSCORE_SCALE = 2
+
+MATCH_COLOR = "steelblue"
+MISS_COLOR = "tomato"
+
+# The number of seconds allowed for 'diamond blastx' to start up, in addition
+# to the per-query time (see --queryTimeout), before a batch is given up on and
+# tried again. And the number of consecutive timeouts after which to stop.
+BLASTX_STARTUP_TIMEOUT = 30
+BLASTX_MAX_TIMEOUTS = 5
+
+# Options (long and short forms) that are always passed to 'diamond blastx' by
+# sampleBitScoresBatch and so cannot also be given via --blastxArgs.
+RESERVED_BLASTX_OPTIONS = {
+    "--query",
+    "-q",
+    "--db",
+    "-d",
+    "--dbsize",
+    "--max-target-seqs",
+    "-k",
+    "--threads",
+    "-p",
+    "--outfmt",
+    "-f",
+}
+
+# Where to put temporary files for DIAMOND. Use a memory-backed filesystem if
+# there is one, to avoid disk I/O.
+TMPDIR = Path("/dev/shm") if Path("/dev/shm").is_dir() else Path(gettempdir())
 
 
 def getArgs() -> argparse.Namespace:
@@ -37,7 +99,11 @@ def getArgs() -> argparse.Namespace:
         "--blastxArgs",
         default="",
         metavar="ARGS",
-        help="Additional (non-sensitivity) arguments to pass to 'diamond blastx'.",
+        help=(
+            "Additional (non-sensitivity) arguments to pass to 'diamond blastx'. "
+            "The --query, --db, --dbsize, --max-target-seqs, --threads, and "
+            "--outfmt options are set by this script and may not be given."
+        ),
     )
 
     parser.add_argument(
@@ -77,181 +143,419 @@ def getArgs() -> argparse.Namespace:
         help="The number of additional errors (non-identical AAs) to add at each step.",
     )
 
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        default=os.cpu_count(),
+        metavar="N",
+        type=int,
+        help="The number of DIAMOND processes to run in parallel.",
+    )
+
+    parser.add_argument(
+        "--queryTimeout",
+        default=2.0,
+        metavar="SECONDS",
+        type=float,
+        help=(
+            "The number of seconds to allow per query when matching a batch of "
+            "queries with 'diamond blastx' before giving up and trying again."
+        ),
+    )
+
     return parser.parse_args()
 
 
-def sampleBitScore(
-    errorCount: int, length: int, blastxArgs: str, tmpdir: Path, verbose: bool
-) -> float:
+def writeFasta(filename: str, prefix: str, sequences: np.ndarray) -> None:
+    """
+    Write sequences to a FASTA file in a single write, with ids made from a
+    prefix and the sequence's index.
+
+    @param filename: The C{str} name of the file to write.
+    @param prefix: The C{str} prefix for the sequence ids. The id of the
+        sequence at index C{i} will be C{f"{prefix}_{i}"}.
+    @param sequences: A 2D C{np.ndarray} of C{uint8} sequence characters,
+        one sequence per row.
+    """
+    payload = b"".join(
+        b">%s_%d\n%s\n" % (prefix.encode(), i, sequence.tobytes())
+        for i, sequence in enumerate(sequences)
+    )
+    with open(filename, "wb", buffering=1 << 20) as fp:
+        fp.write(payload)
+
+
+def runDiamond(cmd: list[str], timeout: float | None = None) -> str:
+    """
+    Run a DIAMOND command, reading its output and error via pipes.
+
+    @param cmd: The C{list} of C{str} command arguments.
+    @param timeout: The C{float} number of seconds to wait for the command to
+        finish, or C{None} to wait indefinitely.
+    @raise subprocess.TimeoutExpired: If the command does not finish within
+        C{timeout} seconds. The process is killed and its output and error
+        are available via the exception's C{stdout} and C{stderr} attributes.
+    @raise subprocess.CalledProcessError: If the command exits with a non-zero
+        status. The command's error output is first written to C{sys.stderr}.
+    @return: The C{str} standard output of the command.
+    """
+    with subprocess.Popen(
+        cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, close_fds=True
+    ) as process:
+        try:
+            stdout, stderr = process.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired as e:
+            process.kill()
+            e.stdout, e.stderr = process.communicate()
+            raise
+
+    if process.returncode:
+        # Show DIAMOND's explanation, which would otherwise be lost in the pipe.
+        print(stderr.decode(errors="replace").rstrip(), file=sys.stderr)
+        raise subprocess.CalledProcessError(process.returncode, cmd, stdout, stderr)
+
+    return stdout.decode("ascii")
+
+
+@cache
+def diamondVersion() -> str:
+    """
+    Get the version of DIAMOND, running 'diamond --version' at most once.
+
+    @return: The C{str} DIAMOND version number.
+    """
+    return runDiamond(["diamond", "--version"]).split()[-1]
+
+
+def makeDatabase(subjectAas: np.ndarray, tmpdir: Path) -> str:
+    """
+    Make a DIAMOND database of subject sequences. The subject at index C{i}
+    is given the id C{s_i}.
+
+    @param subjectAas: A 2D C{np.ndarray} of subject sequences (one per row),
+        as indices into C{AA_ARR}.
+    @param tmpdir: The temporary directory in which to make the database.
+    @return: The C{str} path of the DIAMOND database.
+    """
+    subjectFile = str(tmpdir / "subjects.fasta")
+    dbFile = str(tmpdir / "db")
+
+    writeFasta(subjectFile, "s", AA_BYTES[subjectAas])
+
+    runDiamond(["diamond", "makedb", "--in", subjectFile, "--db", dbFile, "--quiet"])
+
+    return dbFile
+
+
+def sampleBitScoresBatch(
+    errorCount: int,
+    subjectAas: np.ndarray,
+    dbFile: str,
+    blastxArgs: str,
+    rng: np.random.Generator,
+    timeout: float,
+    tmpdir: Path,
+    verbose: bool,
+    sensitivity: str | None = None,
+) -> list[float]:
     """
-    Compute a bitscore for two sequences of a given AA length with a given
-    number of AA errorCount (mismatches).
+    Compute bitscores for a batch of subject sequences, each matched against a
+    query with a given number of AA errors (mismatches), using a single
+    blastx run.
 
     @param errorCount: The C{int} number of AA mismatches.
-    @param length: The C{int} length of the AA subject sequence desired.
+    @param subjectAas: A 2D C{np.ndarray} of subject sequences (one per row),
+        as indices into C{AA_ARR}.
+    @param dbFile: The C{str} path of the DIAMOND database made (by
+        C{makeDatabase}) from C{subjectAas}.
     @param blastxArgs: Additional arguments to pass to diamond blastx.
+    @param rng: The C{np.random.Generator} to use to make the queries.
+    @param timeout: The C{float} number of seconds to wait for blastx.
     @param tmpdir: The temporary directory in which to operate.
     @param verbose: If C{True} write intermediate processing info to sys.stderr.
-    @return: A C{float} bitscore, with a negative value if there is no match.
+    @param sensitivity: The DIAMOND sensitivity argument (if any) included in
+        C{blastxArgs}, used to label verbose output.
+    @raise subprocess.TimeoutExpired: If blastx takes longer than C{timeout}.
+    @return: A C{list} of C{float} bitscores, one per subject, with a zero
+        value where a query did not match its subject.
     """
-    aas = list(CODONS)
-    subject = AARead("subject", "".join(choice(aas) for _ in range(length)))
-
-    # Make a random list of indices to change.
-    indices = list(range(length))
-    shuffle(indices)
-    indices = indices[:errorCount]
-
-    queryAa = list(subject.sequence)
-    for index in indices:
-        existingAA = newAA = subject.sequence[index]
-        while newAA == existingAA:
-            newAA = choice(aas)
-        queryAa[index] = newAA
-
-    queryDNA = DNARead("query", "".join(choice(CODONS[aa]) for aa in queryAa))
+    iterations, length = subjectAas.shape
+    rows = np.arange(iterations)[:, np.newaxis]
+
+    # Make a random set of indices to change in each subject, by taking the
+    # indices of the errorCount smallest values in each row of a random matrix.
+    # The partition index must be less than the length, which is fine when all
+    # indices are to be changed because the slice then takes the whole row.
+    indices = np.argpartition(
+        rng.random((iterations, length)), min(errorCount, length - 1), axis=1
+    )[:, :errorCount]
+
+    # Change the AA at each index to a different one, by adding a random
+    # non-zero amount (modulo the number of AAs) to its index.
+    queryAas = subjectAas.copy()
+    queryAas[rows, indices] = (
+        subjectAas[rows, indices] + rng.integers(1, len(AA_ARR), indices.shape)
+    ) % len(AA_ARR)
 
     # Sanity check that we have the right number of aa mismatches.
-    assert errorCount == sum(a != b for (a, b) in zip(queryAa, subject.sequence))
+    assert (np.count_nonzero(subjectAas != queryAas, axis=1) == errorCount).all()
+
+    # Pick a random codon for each query AA, giving an array of the query DNA
+    # bytes (with three per AA).
+    codons = CODON_TABLE[queryAas, rng.integers(0, SYNONYM_COUNTS[queryAas])]
+    queryDNAs = codons.reshape(iterations, 3 * length)
+
+    queryFile = str(tmpdir / "queries.fasta")
+
+    # Save the query sequences.
+    writeFasta(queryFile, "q", queryDNAs)
+
+    # And match the queries against the DIAMOND database. The effective database
+    # size is set to the length of a single subject so that e-values (and hence
+    # which matches are reported) are the same as they would be if each query
+    # were matched against a database containing only its own subject.
+    cmd = [
+        "diamond",
+        "blastx",
+        *shlex.split(blastxArgs),
+        "--query",
+        queryFile,
+        "--db",
+        dbFile,
+        "--dbsize",
+        str(length),
+        "--max-target-seqs",
+        "1",
+        "--threads",
+        "1",
+        "--outfmt",
+        "6",
+        "qseqid",
+        "sseqid",
+        "bitscore",
+    ]
+    output = runDiamond(cmd, timeout).rstrip()
+
+    # Group the matches by query. DIAMOND reports the best match for each
+    # query first.
+    matches: dict[str, list[tuple[str, float]]] = {}
+    for line in output.split("\n") if output else ():
+        queryId, subjectId, score = line.split("\t")
+        matches.setdefault(queryId, []).append((subjectId, float(score)))
+
+    result = []
+    for i in range(iterations):
+        bitscore = 0.0
+        if hits := matches.get(f"q_{i}"):
+            subjectId, best = hits[0]
+            assert all(best >= b for (_, b) in hits)
+            # A match against any subject other than the query's own is a miss.
+            if subjectId == f"s_{i}":
+                bitscore = best
 
-    subjectFile = str(tmpdir / "subject.fasta")
-    queryFile = str(tmpdir / "query.fasta")
-    dbFile = str(tmpdir / "db")
+        if verbose:
+            # Write each record with a single print, so records from concurrent
+            # workers are not interleaved.
+            print(
+                f"SENSE: {sensitivity}\n"
+                f"SBJCT: {''.join(AA_ARR[subjectAas[i]])}\n"
+                f"QUERY: {''.join(AA_ARR[queryAas[i]])}\n"
+                f"SCORE: {bitscore}\n"
+                f"ERROR: {errorCount}",
+                flush=True,
+            )
 
-    # Save the target (subject) sequence.
-    with open(subjectFile, "w") as fp:
-        print(subject.toString("fasta"), file=fp, end="")
+        result.append(bitscore)
 
-    # And use it to make a DIAMOND database.
-    subprocess.check_output(
-        f"diamond makedb --in {subjectFile!r} --db {dbFile!r} --quiet", shell=True
-    )
+    return result
 
-    # Save the query sequence.
-    with open(queryFile, "w") as fp:
-        print(queryDNA.toString("fasta"), file=fp, end="")
-
-    # And match the query against the DIAMOND database.
-    match = (
-        subprocess.check_output(
-            f"diamond blastx {blastxArgs} --query {queryFile!r} "
-            f"--db {dbFile!r} --outfmt 6 bitscore",
-            shell=True,
-            timeout=2,
-        )
-        .decode("ascii")
-        .rstrip()
-    )
 
-    if match:
-        # Take the first bitscore and check that it's the best.
-        bitscores = list(map(float, match.split("\n")))
-        bitscore = bitscores.pop(0)
-        assert all(bitscore >= b for b in bitscores)
-    else:
-        # Return zero to indicate no match.
-        bitscore = 0.0
+# The subject sequences, set in each worker process by initWorker.
+workerSubjectAas: np.ndarray | None = None
 
-    if verbose:
-        print("SBJCT:", subject.sequence)
-        print("QUERY:", queryAa)
-        print("SCORE:", bitscore)
-        print("ERROR:", errorCount)
 
-    return bitscore
+def initWorker(subjectAas: np.ndarray) -> None:
+    """
+    Initialize a worker process by storing the subject sequences, so they do
+    not have to be sent to the worker with each job.
 
+    @param subjectAas: A 2D C{np.ndarray} of subject sequences (one per row),
+        as indices into C{AA_ARR}.
+    """
+    global workerSubjectAas
+    workerSubjectAas = subjectAas
 
-def plot(
-    ax: Axes,
-    bottom: bool,
-    lhs: bool,
-    rhs: bool,
-    length: int,
+
+def sampleWorker(
+    sensitivity: str | None,
+    step: int,
     errorIncrement: int,
-    dotsize: int,
     verbose: bool,
-    iterations: int,
     blastxArgs: str,
-    sensitivity: str,
-    tmpdir: Path,
-) -> None:
+    dbFile: str,
+    seed: np.random.SeedSequence,
+    queryTimeout: float,
+) -> tuple[list[float], float]:
     """
-    Make a plot of AA identity vs bitscore for a given sensitivity level.
+    Compute the bitscores for one sensitivity level and one error count in a
+    worker process.
 
-    @param ax: The C{Axes} in which to plot.
-    @param bottom: If C{True}, this is in the bottom row of the subplots,
-    @param lhs: If C{True}, this is on the left-hand side of the subplots,
-    @param rhs: If C{True}, this is on the right-hand side of the subplots,
-    @param length: The length of the amino acid sequences to test.
+    Each call uses its own temporary directory so that the DIAMOND query files
+    written by concurrent workers do not collide.
+
+    @param sensitivity: The DIAMOND sensitivity argument.
+    @param step: The C{int} error count step. The number of AA mismatches will
+        be C{step * errorIncrement}.
     @param errorIncrement: The increment to use when increasing the number of
         amino acid mismatches.
-    @param dotsize: The size of the scatter plot dots.
     @param verbose: If C{True}, report intermediate progress.
-    @param iterations: The number of times to test each non-identical amino
-        acid count.
     @param blastxArgs: Extra (non-sensitivity) arguments to pass to DIAMOND.
-    @param sensitivity: The DIAMOND sensitivity argument.
-    @param tmpdir: The directory in which files for DIAMOND can be written.
+    @param dbFile: The C{str} path of the DIAMOND database made (by
+        C{makeDatabase}) from the subjects passed to C{initWorker}.
+    @param seed: The C{np.random.SeedSequence} for this job's random number
+        generator. Each job must be given an independent seed (e.g., from
+        C{SeedSequence.spawn}) so that jobs do not make identical queries.
+    @param queryTimeout: The C{float} number of seconds to allow per query (on
+        top of C{BLASTX_STARTUP_TIMEOUT}) for the blastx run.
+    @raise subprocess.TimeoutExpired: If blastx times out
+        C{BLASTX_MAX_TIMEOUTS} times in a row.
+    @return: A C{tuple} of the C{list} of bitscores (one per subject) and the
+        C{float} number of seconds taken to compute them (including any
+        attempts that timed out).
     """
-    zeroBitscoreScale = 2
-    errorCounts = []
-    bitscores = []
-    color = []
-    successCounts: Counter[int] = Counter()
+    assert workerSubjectAas is not None, "initWorker has not been called."
+    errorCount = step * errorIncrement
+    rng = np.random.default_rng(seed)
     blastxArgs += f" --{sensitivity}" if sensitivity else ""
+    timeout = BLASTX_STARTUP_TIMEOUT + queryTimeout * len(workerSubjectAas)
+    timeouts = 0
 
-    matchColor = "steelblue"
-    missColor = "tomato"
-    missCounts: Counter[int] = Counter()
-
-    start = time()
-
-    for errorCount in range(0, length + 1, errorIncrement):
-        if verbose:
-            print(f"Making {errorCount} errors:")
-
-        iteration = 0
-        while iteration < iterations:
-            if verbose:
-                print(f"  Iteration {iteration + 1}/{iterations}")
+    if verbose:
+        print(f"Making {errorCount} errors with sensitivity {sensitivity}:")
 
+    with TemporaryDirectory(dir=TMPDIR) as tmpdir:
+        # Time all attempts, including any that time out.
+        start = time()
+        while True:
             try:
-                score = sampleBitScore(errorCount, length, blastxArgs, tmpdir, verbose)
-            except subprocess.TimeoutExpired:
+                scores = sampleBitScoresBatch(
+                    errorCount,
+                    workerSubjectAas,
+                    dbFile,
+                    blastxArgs,
+                    rng,
+                    timeout,
+                    Path(tmpdir),
+                    verbose,
+                    sensitivity,
+                )
+            except subprocess.TimeoutExpired as e:
+                timeouts += 1
+                if timeouts == BLASTX_MAX_TIMEOUTS:
+                    print(
+                        f"DIAMOND subprocess timed out {timeouts} times in a row "
+                        f"(timeout {timeout:.1f}s). Giving up. Consider increasing "
+                        "--queryTimeout.",
+                        file=sys.stderr,
+                    )
+                    raise
+
                 # On OS X 14.5 the Python subprocess call to diamond blastx very
                 # occasionally does not return. I don't know why. When making the
                 # identical call on the command line, diamond (v2.1.9) exits
-                # immediately with status zero and no output. So we just do it again.
-                print("DIAMOND subprocess timeout! Repeating.", file=sys.stderr)
+                # immediately with status zero and no output. So we just do it again,
+                # reporting whatever diamond wrote to stderr in case it helps
+                # diagnose the problem.
+                stderr = e.stderr.decode(errors="replace").rstrip() if e.stderr else ""
+                print(
+                    "DIAMOND subprocess timeout! Repeating. DIAMOND stderr:",
+                    stderr or "(none)",
+                    file=sys.stderr,
+                )
             else:
-                iteration += 1
-                if score == 0.0:
-                    bitscores.append(
-                        (missCounts[errorCount] - iterations) * zeroBitscoreScale
-                    )
-                    missCounts[errorCount] += 1
-                    color.append(missColor)
-                else:
-                    bitscores.append(score)
-                    color.append(matchColor)
-                    successCounts[errorCount] += 1
+                return scores, time() - start
 
-        errorCounts.extend([errorCount / length * 100.0] * iterations)
 
-    elapsed = int(time() - start)
+def collect(
+    scores: list[list[float]],
+    elapsed: float,
+    length: int,
+    errorIncrement: int,
+    iterations: int,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, int]:
+    """
+    Collect AA identity vs bitscore plot data for a given sensitivity level.
+
+    @param scores: A C{list} with a C{list} of C{iterations} bitscores for
+        each error count step (as returned by C{sampleWorker}).
+    @param elapsed: The C{float} total number of seconds taken to compute the
+        bitscores.
+    @param length: The length of the amino acid sequences tested.
+    @param errorIncrement: The increment used when increasing the number of
+        amino acid mismatches.
+    @param iterations: The number of times each non-identical amino acid
+        count was tested.
+    @return: A C{tuple} of the scatter plot x values (percent AA difference),
+        the scatter plot y values (bitscores), a Boolean mask of the scatter
+        plot values that are matches (as opposed to misses), the detection
+        rate x and y values, and the C{int} elapsed time in seconds.
+    """
+    bitscores = np.array(scores)
+    differences = np.arange(0, length + 1, errorIncrement) / length * 100.0
+    misses = bitscores == 0.0
+
+    # Plot the misses for each error count at increasing negative values, with
+    # the first at -iterations * ZERO_BITSCORE_SCALE.
+    missIndices = np.cumsum(misses, axis=1) - 1
+    bitscores = np.where(
+        misses, (missIndices - iterations) * ZERO_BITSCORE_SCALE, bitscores
+    )
 
     # Compute the overall success rate for each error count. This will be plotted using
     # the right-hand axis.
-    successX = []
-    successY = []
-    threshold50 = None
+    successRates = (~misses).mean(axis=1)
+
+    return (
+        np.repeat(differences, iterations),
+        bitscores.ravel(),
+        ~misses.ravel(),
+        differences,
+        successRates,
+        int(elapsed),
+    )
 
-    for errorCount in range(0, length + 1, errorIncrement):
-        detectionProb = successCounts[errorCount] / iterations
-        if detectionProb < 0.5 and threshold50 is None:
-            threshold50 = int(errorCount / length * 100.0)
-        successX.append(errorCount / length * 100.0)
-        successY.append(detectionProb)
+
+def render(
+    ax: Axes,
+    bottom: bool,
+    lhs: bool,
+    rhs: bool,
+    data: tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, int],
+    dotsize: int,
+    iterations: int,
+    sensitivity: str | None,
+) -> None:
+    """
+    Make a plot of AA identity vs bitscore for a given sensitivity level.
+
+    @param ax: The C{Axes} in which to plot.
+    @param bottom: If C{True}, this is in the bottom row of the subplots,
+    @param lhs: If C{True}, this is on the left-hand side of the subplots,
+    @param rhs: If C{True}, this is on the right-hand side of the subplots,
+    @param data: The C{tuple} of data returned by C{collect}.
+    @param dotsize: The size of the scatter plot dots.
+    @param iterations: The number of times each non-identical amino acid count
+        was tested.
+    @param sensitivity: The DIAMOND sensitivity argument.
+    """
+    errorCounts, bitscores, matches, successX, successY, elapsed = data
+
+    # Find the first AA difference level at which detection drops below 50%.
+    threshold50 = None
+    for x, y in zip(successX, successY):
+        if y < 0.5:
+            threshold50 = int(x)
+            break
 
     titleFontSize = 10
     axisFontSize = 8
@@ -262,14 +566,15 @@ def plot(
         + f"  Elapsed: {elapsed}s.\n"
         f"50% detection: {threshold50}% AA difference."
     )
-    ax.scatter(errorCounts, bitscores, s=dotsize, color=color)
+    ax.scatter(errorCounts[matches], bitscores[matches], s=dotsize, color=MATCH_COLOR)
+    ax.scatter(errorCounts[~matches], bitscores[~matches], s=dotsize, color=MISS_COLOR)
     ax.set_title(title, fontsize=titleFontSize)
     if bottom:
         ax.set_xlabel("Query % AA difference", fontsize=axisFontSize)
     if lhs:
         ax.set_ylabel("DIAMOND bitscore", fontsize=axisFontSize)
     ax.set_xlim((0.0, 100.0))
-    ax.set_ylim((-(iterations + 1) * zeroBitscoreScale, max(bitscores) + 5.0))
+    ax.set_ylim((-(iterations + 1) * ZERO_BITSCORE_SCALE, max(bitscores) + 5.0))
     ax.grid()
 
     ax2 = ax.twinx()
@@ -283,6 +588,25 @@ def plot(
 def main():
     args = getArgs()
 
+    # Fail fast if DIAMOND is not available.
+    if shutil.which("diamond") is None:
+        sys.exit("Could not find the 'diamond' executable in your PATH.")
+
+    if args.jobs < 1:
+        sys.exit("--jobs must be at least 1.")
+
+    if args.queryTimeout <= 0.0:
+        sys.exit("--queryTimeout must be greater than zero.")
+
+    for arg in shlex.split(args.blastxArgs):
+        if arg.split("=", 1)[0] in RESERVED_BLASTX_OPTIONS:
+            sys.exit(
+                f"The {arg!r} option may not be given in --blastxArgs because "
+                "it is set by this script."
+            )
+
+    print(f"Using DIAMOND version {diamondVersion()}.")
+
     # The ordering here is according to increasing elapsed time. This is as determined
     # by an earlier run, as opposed to being what a regular English-speaker might
     # expect from the words.
@@ -303,57 +627,121 @@ def main():
     fig, axes = plt.subplots(
         rows, cols, figsize=(side * cols, side * rows), sharex="col", sharey="row"
     )
-    dimensions = dimensionalIterator((rows, cols))
-
-    with TemporaryDirectory() as tmpdir:
-        tmpdir = Path(tmpdir)
-        for sensitivity in sensitivities:
-            print(f"Processing sensitivity: {sensitivity}.")
-            row, col = next(dimensions)
-
-            # Here's how to know if you're on the bottom row or on the very right of the
-            # second-bottom row after the subplots in the very bottom row are all
-            # done. But using this to put an x-axis label on those second-bottom row
-            # subplots looks weird.
-            #
-            # bottom = (row == rows - 1) or (
-            #     row == rows - 2 and
-            #     len(sensitivities) % cols and
-            #     col >= len(sensitivities) % cols
-            # )
-
-            plot(
-                axes[row][col],
-                row == rows - 1,
-                col == 0,
-                col == cols - 1,
-                args.length,
-                args.errorIncrement,
-                args.dotsize,
-                args.verbose,
-                args.iterations,
-                args.blastxArgs,
-                sensitivity,
-                tmpdir,
-            )
+
+    errorCountSteps = len(range(0, args.length + 1, args.errorIncrement))
+    jobs = [
+        (sensitivity, step)
+        for sensitivity in sensitivities
+        for step in range(errorCountSteps)
+    ]
+
+    # Make independent random number generator seeds for the subjects and for
+    # each (sensitivity, error count) job, so that no two workers produce the
+    # same random sequences.
+    subjectSeed, *jobSeeds = np.random.SeedSequence().spawn(1 + len(jobs))
+
+    # Make all the subjects (one per iteration) up front. The same subjects are
+    # used for every error count, and they do not depend on the sensitivity, so a
+    # single DIAMOND database of them can be shared by all the workers.
+    subjectAas = np.random.default_rng(subjectSeed).integers(
+        0, len(AA_ARR), (args.iterations, args.length), dtype=np.uint8
+    )
+
+    with TemporaryDirectory(dir=TMPDIR) as tmpdir:
+        worker = partial(
+            sampleWorker,
+            errorIncrement=args.errorIncrement,
+            verbose=args.verbose,
+            blastxArgs=args.blastxArgs,
+            dbFile=makeDatabase(subjectAas, Path(tmpdir)),
+            queryTimeout=args.queryTimeout,
+        )
+
+        # Each DIAMOND run is single-threaded, so run one per (sensitivity, error
+        # count) combination in parallel.
+        scores: dict[str | None, list[list[float]]] = {
+            sensitivity: [[] for _ in range(errorCountSteps)]
+            for sensitivity in sensitivities
+        }
+        elapsed: dict[str | None, float] = dict.fromkeys(sensitivities, 0.0)
+        remaining = Counter(
+            {sensitivity: errorCountSteps for sensitivity in sensitivities}
+        )
+
+        # Give the subjects to each worker once, rather than with every job. On
+        # Linux, use fork so the workers inherit them without them being pickled.
+        with ProcessPoolExecutor(
+            max_workers=args.jobs,
+            mp_context=get_context("fork" if sys.platform == "linux" else None),
+            initializer=initWorker,
+            initargs=(subjectAas,),
+        ) as executor:
+            futures = {
+                executor.submit(worker, *job, seed=seed): job
+                for job, seed in zip(jobs, jobSeeds)
+            }
+
+            for future in as_completed(futures):
+                sensitivity, step = futures[future]
+                try:
+                    scores[sensitivity][step], seconds = future.result()
+                except Exception:
+                    # Don't wait for all the remaining jobs before reporting the
+                    # error.
+                    executor.shutdown(cancel_futures=True)
+                    raise
+                elapsed[sensitivity] += seconds
+                remaining[sensitivity] -= 1
+                if remaining[sensitivity] == 0:
+                    print(f"Processed sensitivity: {sensitivity}.")
+
+    results = [
+        collect(
+            scores[sensitivity],
+            elapsed[sensitivity],
+            args.length,
+            args.errorIncrement,
+            args.iterations,
+        )
+        for sensitivity in sensitivities
+    ]
+
+    for index, (sensitivity, data) in enumerate(zip(sensitivities, results)):
+        row, col = divmod(index, cols)
+
+        # Here's how to know if you're on the bottom row or on the very right of the
+        # second-bottom row after the subplots in the very bottom row are all
+        # done. But using this to put an x-axis label on those second-bottom row
+        # subplots looks weird.
+        #
+        # bottom = (row == rows - 1) or (
+        #     row == rows - 2 and
+        #     len(sensitivities) % cols and
+        #     col >= len(sensitivities) % cols
+        # )
+
+        render(
+            axes[row][col],
+            row == rows - 1,
+            col == 0,
+            col == cols - 1,
+            data,
+            args.dotsize,
+            args.iterations,
+            sensitivity,
+        )
 
     # Hide the final subplots (if any) that have no content. We do this because the
     # panel is a rectangular grid and some of the plots at the end of the last row may
     # be unused.
-    for row, col in dimensions:
+    for index in range(len(sensitivities), rows * cols):
+        row, col = divmod(index, cols)
         axes[row][col].axis("off")
 
-    version = (
-        subprocess.check_output("diamond --version", shell=True)
-        .decode()
-        .rstrip()
-        .split()[-1]
-    )
-
     fig.tight_layout(rect=[0, 0, 1, 0.89])
 
     fig.suptitle(
-        f"Query %AA difference vs DIAMOND (v{version}) bitscore."
+        f"Query %AA difference vs DIAMOND (v{diamondVersion()}) bitscore."
         "\n"
         f"Sequence length {args.length} with {args.iterations} iterations at each "
         "identity level."